@@ -1,9 +1,12 @@
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 from pathlib import Path
 from datetime import datetime, timedelta
 import json
+import orjson
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Dict
 from models import (
     PreACTScore, DistrictTrend, SubgroupPerformance, 
@@ -15,13 +18,22 @@ class PreACTDataAPI:
     DOWNLOAD_BASE = "https://dpi.wi.gov/sites/default/files/wise/downloads/"
     CACHE_DIR = Path("./cache")
     CACHE_DURATION = timedelta(days=30)
+    CATEGORY_COLUMNS = [
+        'SCHOOL_YEAR', 'TEST_SUBJECT', 'TEST_GROUP', 'GROUP_BY',
+        'GROUP_BY_VALUE', 'TEST_RESULT', 'CHARTER_IND'
+    ]
     
     def __init__(self):
         self.CACHE_DIR.mkdir(exist_ok=True)
+        self._session = requests.Session()
+        self._session.headers.update({'User-Agent': 'Mozilla/5.0'})
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=3)
+        self._session.mount('https://', adapter)
+        self._df_cache: Dict[Optional[str], pd.DataFrame] = {}
     
     def find_available_files(self):
         try:
-            response = requests.get(self.BASE_URL, timeout=10)
+            response = self._session.get(self.BASE_URL, timeout=10)
             response.raise_for_status()
             import re
             files = re.findall(r'href="([^"]*preact_secure_statewide_certified[^"]*\.zip)"', response.text)
@@ -31,8 +43,30 @@ class PreACTDataAPI:
             return []
     
     def get_data(self, school_year: str = None, force_refresh: bool = False) -> Optional[pd.DataFrame]:
+        # Hand out shallow copies so callers assigning into the frame can't alter the cache
+        if not force_refresh and school_year in self._df_cache:
+            return self._df_cache[school_year].copy(deep=False)
+        
+        df = self._get_data_uncached(school_year, force_refresh)
+        if df is not None:
+            df = self._optimize_dtypes(df)
+            self._df_cache[school_year] = df
+            return df.copy(deep=False)
+        return df
+    
+    def _optimize_dtypes(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Shrink the integer key columns and dictionary-encode the low-cardinality labels"""
+        narrow = {'DISTRICT_CODE': 'int32', 'GRADE_LEVEL': 'int8'}
+        dtypes = {
+            col: dtype for col, dtype in narrow.items()
+            if col in df.columns and pd.api.types.is_integer_dtype(df[col])
+        }
+        dtypes.update({col: 'category' for col in self.CATEGORY_COLUMNS if col in df.columns})
+        return df.astype(dtypes)
+    
+    def _get_data_uncached(self, school_year: str = None, force_refresh: bool = False) -> Optional[pd.DataFrame]:
         if school_year:
-            cache_file = self.CACHE_DIR / f"preact_{school_year}.csv"
+            cache_file = self.CACHE_DIR / f"preact_{school_year}.parquet"
             cache_meta = self.CACHE_DIR / f"preact_{school_year}.meta"
             filename = f"preact_secure_statewide_certified_{school_year}.zip"
             url = f"{self.DOWNLOAD_BASE}{filename}"
@@ -40,14 +74,14 @@ class PreACTDataAPI:
             available = self.find_available_files()
             if not available:
                 print("No public data files found")
-                cache_file = self.CACHE_DIR / "preact_latest.csv"
+                cache_file = self.CACHE_DIR / "preact_latest.parquet"
                 if cache_file.exists():
                     print("Using stale cache")
-                    return pd.read_csv(cache_file)
+                    return pd.read_parquet(cache_file)
                 return None
             url = available[0]
             filename = url.split('/')[-1]
-            cache_file = self.CACHE_DIR / f"preact_latest.csv"
+            cache_file = self.CACHE_DIR / f"preact_latest.parquet"
             cache_meta = self.CACHE_DIR / f"preact_latest.meta"
         
         if not school_year:
@@ -60,27 +94,24 @@ class PreACTDataAPI:
                     cached_date = datetime.fromisoformat(meta['cached_at'])
                     if datetime.now() - cached_date < self.CACHE_DURATION:
                         print(f"Using cached data from {meta.get('filename', 'cache')}")
-                        return pd.read_csv(cache_file)
-        
-        session = requests.Session()
-        session.headers.update({'User-Agent': 'Mozilla/5.0'})
+                        return pd.read_parquet(cache_file)
         
         print(f"Downloading {filename}...")
         
+        zip_path = self.CACHE_DIR / filename
         try:
-            response = session.get(url, timeout=30, allow_redirects=True)
-            response.raise_for_status()
-            
-            zip_path = self.CACHE_DIR / filename
-            with open(zip_path, 'wb') as f:
-                f.write(response.content)
+            with self._session.get(url, timeout=30, allow_redirects=True, stream=True) as response:
+                response.raise_for_status()
+                with open(zip_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
             
             with zipfile.ZipFile(zip_path, 'r') as z:
                 csv_files = [f for f in z.namelist() if f.endswith('.csv')]
                 if csv_files:
                     with z.open(csv_files[0]) as csv_file:
-                        df = pd.read_csv(csv_file)
-                        df.to_csv(cache_file, index=False)
+                        df = pd.read_csv(csv_file, engine='pyarrow')
+                        df.to_parquet(cache_file, engine='pyarrow', compression='snappy', index=False)
                         
                         with open(cache_meta, 'w') as f:
                             json.dump({
@@ -97,10 +128,13 @@ class PreACTDataAPI:
             print(f"HTTP Error {e.response.status_code}: {url}")
         except Exception as e:
             print(f"Error: {e}")
+        finally:
+            # The Parquet cache holds everything we need; don't keep the archive around
+            zip_path.unlink(missing_ok=True)
         
         if cache_file.exists():
             print("Using stale cache")
-            return pd.read_csv(cache_file)
+            return pd.read_parquet(cache_file)
         
         return None
     
@@ -110,62 +144,62 @@ class PreACTDataAPI:
             df = self.get_data()
             return df
         
-        all_data = []
+        school_years = [f"{year}-{str(year+1)[-2:]}" for year in range(start_year, end_year + 1)]
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(self.get_data, school_years))
         
-        for year in range(start_year, end_year + 1):
-            school_year = f"{year}-{str(year+1)[-2:]}"
-            df = self.get_data(school_year)
-            if df is not None:
-                all_data.append(df)
+        all_data = [df for df in results if df is not None]
         
         if all_data:
-            combined = pd.concat(all_data, ignore_index=True)
+            # Categories differ between years, so concat falls back to object; re-encode
+            combined = self._optimize_dtypes(pd.concat(all_data, ignore_index=True))
             print(f"Total records loaded: {len(combined)}")
             return combined
         
         return None
     
-    def _safe_float(self, value) -> Optional[float]:
-        """Safely convert to float, handling '*' and other non-numeric values"""
-        if pd.isna(value) or value == '*' or value == '':
-            return None
-        try:
-            return float(value)
-        except (ValueError, TypeError):
-            return None
-    
-    def _safe_int(self, value) -> Optional[int]:
-        """Safely convert to int"""
-        if pd.isna(value) or value == '*' or value == '':
-            return None
-        try:
-            return int(value)
-        except (ValueError, TypeError):
-            return None
+    def _numeric_column(self, series: pd.Series, cast=float) -> list:
+        """Convert a column to float (or int), '*' and other non-numeric values become None"""
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float).tolist()
+        return [None if v != v else cast(v) for v in values]
     
     def parse_records_to_models(self, df: pd.DataFrame) -> List[PreACTScore]:
         """Convert DataFrame to PreACTScore models"""
         records = []
         
-        for _, row in df.iterrows():
+        text = {c: df[c].to_numpy().astype(str).tolist() for c in (
+            'SCHOOL_YEAR', 'DISTRICT_CODE', 'DISTRICT_NAME', 'SCHOOL_CODE', 'SCHOOL_NAME',
+            'TEST_SUBJECT', 'TEST_GROUP', 'GROUP_BY', 'GROUP_BY_VALUE',
+            'TEST_RESULT', 'TEST_RESULT_CODE'
+        )}
+        present = {c: df[c].notna().tolist() for c in (
+            'SCHOOL_CODE', 'SCHOOL_NAME', 'TEST_RESULT', 'TEST_RESULT_CODE'
+        )}
+        grade_levels = df['GRADE_LEVEL'].tolist()
+        charter = (df['CHARTER_IND'].astype(str).str.lower() == 'yes').tolist()
+        student_counts = self._numeric_column(df['STUDENT_COUNT'], int)
+        group_counts = self._numeric_column(df['GROUP_COUNT'], int)
+        average_scores = self._numeric_column(df['AVERAGE_SCORE'])
+        
+        for i in range(len(df)):
             try:
                 record = PreACTScore(
-                    school_year=str(row['SCHOOL_YEAR']),
-                    district_code=str(row['DISTRICT_CODE']),
-                    district_name=str(row['DISTRICT_NAME']),
-                    school_code=str(row['SCHOOL_CODE']) if pd.notna(row['SCHOOL_CODE']) else None,
-                    school_name=str(row['SCHOOL_NAME']) if pd.notna(row['SCHOOL_NAME']) else None,
-                    grade_level=int(row['GRADE_LEVEL']),
-                    test_subject=str(row['TEST_SUBJECT']),
-                    test_group=str(row['TEST_GROUP']),
-                    group_by=str(row['GROUP_BY']),
-                    group_by_value=str(row['GROUP_BY_VALUE']),
-                    student_count=self._safe_int(row['STUDENT_COUNT']),
-                    group_count=self._safe_int(row['GROUP_COUNT']),
-                    average_score=self._safe_float(row['AVERAGE_SCORE']),
-                    test_result=str(row['TEST_RESULT']) if pd.notna(row['TEST_RESULT']) else None,
-                    test_result_code=str(row['TEST_RESULT_CODE']) if pd.notna(row['TEST_RESULT_CODE']) else None,
-                    charter_indicator=str(row['CHARTER_IND']).lower() == 'yes'
+                    school_year=text['SCHOOL_YEAR'][i],
+                    district_code=text['DISTRICT_CODE'][i],
+                    district_name=text['DISTRICT_NAME'][i],
+                    school_code=text['SCHOOL_CODE'][i] if present['SCHOOL_CODE'][i] else None,
+                    school_name=text['SCHOOL_NAME'][i] if present['SCHOOL_NAME'][i] else None,
+                    grade_level=int(grade_levels[i]),
+                    test_subject=text['TEST_SUBJECT'][i],
+                    test_group=text['TEST_GROUP'][i],
+                    group_by=text['GROUP_BY'][i],
+                    group_by_value=text['GROUP_BY_VALUE'][i],
+                    student_count=student_counts[i],
+                    group_count=group_counts[i],
+                    average_score=average_scores[i],
+                    test_result=text['TEST_RESULT'][i] if present['TEST_RESULT'][i] else None,
+                    test_result_code=text['TEST_RESULT_CODE'][i] if present['TEST_RESULT_CODE'][i] else None,
+                    charter_indicator=charter[i]
                 )
                 records.append(record)
             except Exception as e:
@@ -174,75 +208,87 @@ class PreACTDataAPI:
         
         return records
     
-    def get_district_trends(self, df: pd.DataFrame, district_code: str) -> List[DistrictTrend]:
+    def _district_rows(self, df: pd.DataFrame) -> pd.Series:
+        """True for district-level rows, i.e. rows without a SCHOOL_CODE"""
+        return df['SCHOOL_CODE'].isna() | (df['SCHOOL_CODE'] == '') | (df['SCHOOL_CODE'] == 0)
+    
+    def _district_slice(self, df: pd.DataFrame, district_code: str) -> pd.DataFrame:
+        """District-level PreACT rows for one district, in a single scan of df"""
         district_code_int = int(district_code)
-        filtered = df[
-            (df['DISTRICT_CODE'] == district_code_int) &
-            (df['SCHOOL_CODE'].isna() | (df['SCHOOL_CODE'] == '') | (df['SCHOOL_CODE'] == 0)) &
-            (df['GROUP_BY'] == 'All Students') &
-            (df['TEST_GROUP'] == 'PreACT')
-        ].copy()
+        district_rows = self._district_rows(df)
+        return df.query(
+            "@district_rows and DISTRICT_CODE == @district_code_int and TEST_GROUP == 'PreACT'"
+        )
+    
+    def get_district_trends(self, df: pd.DataFrame, district_code: str,
+                            district: Optional[pd.DataFrame] = None) -> List[DistrictTrend]:
+        district = district if district is not None else self._district_slice(df, district_code)
+        filtered = district[district['GROUP_BY'] == 'All Students']
         
         if filtered.empty:
             return []
         
+        district_name = str(filtered.iloc[0]['DISTRICT_NAME'])
+        
+        # Stable sort keeps the original row order inside each (year, grade) run
+        keys = ['SCHOOL_YEAR', 'GRADE_LEVEL']
+        filtered = filtered.sort_values(keys, kind='mergesort')
+        scores = filtered[keys].assign(
+            SUBJECT=filtered['TEST_SUBJECT'].str.lower(),
+            SCORE=pd.to_numeric(filtered['AVERAGE_SCORE'], errors='coerce')
+        ).groupby(keys + ['SUBJECT'], sort=False, observed=True)['SCORE'].last().unstack()
+        scores = scores.astype(object).where(scores.notna(), None)
+        
+        composite = filtered[filtered['TEST_SUBJECT'] == 'Composite'].drop_duplicates(keys)
+        counts = pd.to_numeric(composite.set_index(keys)['STUDENT_COUNT'], errors='coerce')
+        
         trends = []
-        for (year, grade), group in filtered.groupby(['SCHOOL_YEAR', 'GRADE_LEVEL']):
-            scores = {}
-            for _, row in group.iterrows():
-                subject = row['TEST_SUBJECT']
-                score = self._safe_float(row['AVERAGE_SCORE'])
-                if score is not None:
-                    scores[subject.lower()] = score
-            
-            composite_row = group[group['TEST_SUBJECT'] == 'Composite']
-            student_count = 0
-            if not composite_row.empty:
-                student_count = self._safe_int(composite_row.iloc[0]['STUDENT_COUNT']) or 0
-            
+        for (year, grade), row in scores.to_dict('index').items():
+            student_count = counts.get((year, grade))
             trend = DistrictTrend(
                 district_code=district_code,
-                district_name=str(filtered.iloc[0]['DISTRICT_NAME']),
+                district_name=district_name,
                 school_year=str(year),
                 grade_level=int(grade),
-                composite_score=scores.get('composite'),
-                english_score=scores.get('english'),
-                math_score=scores.get('mathematics'),
-                reading_score=scores.get('reading'),
-                science_score=scores.get('science'),
-                stem_score=scores.get('stem'),
-                total_students=student_count
+                composite_score=row.get('composite'),
+                english_score=row.get('english'),
+                math_score=row.get('mathematics'),
+                reading_score=row.get('reading'),
+                science_score=row.get('science'),
+                stem_score=row.get('stem'),
+                total_students=int(student_count) if pd.notna(student_count) else 0
             )
             trends.append(trend)
         
         return sorted(trends, key=lambda x: (x.school_year, x.grade_level))
     
-    def get_subgroup_performance(self, df: pd.DataFrame, district_code: str) -> List[SubgroupPerformance]:
-        district_code_int = int(district_code)
-        filtered = df[
-            (df['DISTRICT_CODE'] == district_code_int) &
-            (df['SCHOOL_CODE'].isna() | (df['SCHOOL_CODE'] == '') | (df['SCHOOL_CODE'] == 0)) &
-            (df['TEST_SUBJECT'] == 'Composite') &
-            (df['GROUP_BY'] != 'All Students') &
-            (df['TEST_GROUP'] == 'PreACT')
-        ].copy()
+    def get_subgroup_performance(self, df: pd.DataFrame, district_code: str,
+                                 district: Optional[pd.DataFrame] = None) -> List[SubgroupPerformance]:
+        district = district if district is not None else self._district_slice(df, district_code)
+        filtered = district[
+            (district['TEST_SUBJECT'] == 'Composite') &
+            (district['GROUP_BY'] != 'All Students')
+        ]
         
         if filtered.empty:
             return []
         
+        columns = ['SCHOOL_YEAR', 'DISTRICT_NAME', 'GRADE_LEVEL', 'GROUP_BY', 'GROUP_BY_VALUE']
+        rows = zip(
+            filtered[columns].itertuples(index=False, name=None),
+            self._numeric_column(filtered['AVERAGE_SCORE']),
+            self._numeric_column(filtered['STUDENT_COUNT'], int)
+        )
         subgroups = []
-        for _, row in filtered.iterrows():
-            score = self._safe_float(row['AVERAGE_SCORE'])
-            student_count = self._safe_int(row['STUDENT_COUNT'])
-            
+        for (year, name, grade, group_by, group_value), score, student_count in rows:
             if score is not None and student_count is not None:
                 subgroup = SubgroupPerformance(
-                    school_year=str(row['SCHOOL_YEAR']),
+                    school_year=str(year),
                     district_code=district_code,
-                    district_name=str(row['DISTRICT_NAME']),
-                    grade_level=int(row['GRADE_LEVEL']),
-                    subgroup_category=str(row['GROUP_BY']),
-                    subgroup_value=str(row['GROUP_BY_VALUE']),
+                    district_name=str(name),
+                    grade_level=int(grade),
+                    subgroup_category=str(group_by),
+                    subgroup_value=str(group_value),
                     composite_score=score,
                     student_count=student_count
                 )
@@ -251,26 +297,27 @@ class PreACTDataAPI:
         return sorted(subgroups, key=lambda x: (x.school_year, x.grade_level, x.subgroup_category))
     
     def get_readiness_breakdown(self, df: pd.DataFrame, district_code: str) -> List[ReadinessBreakdown]:
-        filtered = df[
-            (df['DISTRICT_CODE'] == district_code) &
-            (df['SCHOOL_CODE'].isna() | (df['SCHOOL_CODE'] == '')) &
-            (df['GROUP_BY'] == 'All Students') &
-            (df['TEST_GROUP'] == 'PreACT')
-        ].copy()
+        district = self._district_slice(df, district_code)
+        filtered = district[district['GROUP_BY'] == 'All Students']
         
         if filtered.empty:
             return []
         
+        columns = ['SCHOOL_YEAR', 'DISTRICT_NAME', 'GRADE_LEVEL', 'TEST_SUBJECT', 'TEST_RESULT']
+        rows = zip(
+            filtered[columns].itertuples(index=False, name=None),
+            self._numeric_column(filtered['STUDENT_COUNT'], int)
+        )
         breakdowns = []
-        for _, row in filtered.iterrows():
+        for (year, name, grade, subject, result), student_count in rows:
             breakdown = ReadinessBreakdown(
-                school_year=str(row['SCHOOL_YEAR']),
+                school_year=str(year),
                 district_code=district_code,
-                district_name=str(row['DISTRICT_NAME']),
-                grade_level=int(row['GRADE_LEVEL']),
-                test_subject=str(row['TEST_SUBJECT']),
-                test_result=str(row['TEST_RESULT']) if pd.notna(row['TEST_RESULT']) else None,
-                student_count=self._safe_int(row['STUDENT_COUNT'])
+                district_name=str(name),
+                grade_level=int(grade),
+                test_subject=str(subject),
+                test_result=str(result) if pd.notna(result) else None,
+                student_count=student_count
             )
             breakdowns.append(breakdown)
         
@@ -279,18 +326,21 @@ class PreACTDataAPI:
     def get_all_districts(self, df: pd.DataFrame) -> List[Dict]:
         unique_districts = df[['DISTRICT_CODE', 'DISTRICT_NAME']].drop_duplicates()
         districts = [
-            {'code': str(row['DISTRICT_CODE']), 'name': str(row['DISTRICT_NAME'])}
-            for _, row in unique_districts.iterrows()
+            {'code': str(code), 'name': str(name)}
+            for code, name in unique_districts.itertuples(index=False, name=None)
         ]
         return sorted(districts, key=lambda x: x['name'])
     
-    def get_district_summary(self, district_code: str, start_year: int = 2020, end_year: int = 2024) -> Optional[DistrictSummary]:
-        df = self.get_multi_year_data(start_year, end_year)
+    def get_district_summary(self, district_code: str, start_year: int = 2020, end_year: int = 2024,
+                             df: Optional[pd.DataFrame] = None) -> Optional[DistrictSummary]:
+        df = df if df is not None else self.get_multi_year_data(start_year, end_year)
         if df is None:
             return None
         
-        trends = self.get_district_trends(df, district_code)
-        subgroups = self.get_subgroup_performance(df, district_code)
+        # Scan the full frame once and share the district's rows
+        district = self._district_slice(df, district_code)
+        trends = self.get_district_trends(df, district_code, district=district)
+        subgroups = self.get_subgroup_performance(df, district_code, district=district)
         
         if not trends:
             return None
@@ -308,12 +358,12 @@ class PreACTDataAPI:
             total_students_tested=total_students
         )
     
-    def export_to_json(self, district_code: str, output_file: str, start_year: int, end_year: int):
-        summary = self.get_district_summary(district_code, start_year, end_year)
+    def export_to_json(self, district_code: str, output_file: str, start_year: int, end_year: int,
+                       df: Optional[pd.DataFrame] = None):
+        summary = self.get_district_summary(district_code, start_year, end_year, df=df)
         if summary:
             Path(output_file).parent.mkdir(parents=True, exist_ok=True)
-            with open(output_file, 'w') as f:
-                json.dump(summary.__dict__, f, indent=2, default=str)
+            Path(output_file).write_bytes(orjson.dumps(summary, option=orjson.OPT_INDENT_2, default=str))
             print(f"Exported to {output_file}")
 
 def main():
@@ -323,7 +373,8 @@ def main():
     print("Waukesha District - Auto Data Pull")
     print("=" * 60)
     
-    summary = api.get_district_summary("6174", start_year=2020, end_year=2024)
+    df = api.get_multi_year_data(2020, 2024)
+    summary = api.get_district_summary("6174", start_year=2020, end_year=2024, df=df)
     
     if summary and summary.trends:
         print(f"\nDistrict: {summary.district_name}")
@@ -336,7 +387,7 @@ def main():
     else:
         print("No data available for this district")
     
-    api.export_to_json("6174", "./output/waukesha_preact.json", 2020, 2024)
+    api.export_to_json("6174", "./output/waukesha_preact.json", 2020, 2024, df=df)
 
 if __name__ == "__main__":
     main()